@@ -112,7 +112,7 @@ class AIWriter:
             Return the analysis in a structured format.
             """
 
-            analysis = await self.openai_handler.generate_text(analysis_prompt)
+            analysis = await self.openai_handler.generate_text(analysis_prompt, temperature=0)
 
             if analysis:
                 logger.info("Writing style analysis completed successfully")
@@ -162,7 +162,7 @@ class AIWriter:
             Provide a score (1-10) and brief feedback.
             """
 
-            validation_result = await self.openai_handler.generate_text(validation_prompt)
+            validation_result = await self.openai_handler.generate_text(validation_prompt, temperature=0)
 
             logger.info("Content quality validation completed")
 
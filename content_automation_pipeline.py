@@ -362,9 +362,8 @@ class ContentAutomationPipeline:
             Return a concise image description (max 100 words) suitable for DALL-E image generation.
             """
             
-            from openai_handler import OpenAIHandler
-            openai_handler = OpenAIHandler()
-            image_description = await openai_handler.generate_text(description_prompt)
+            # Reuse the image handler's client rather than opening a new connection pool per call
+            image_description = await self.image_handler.openai_handler.generate_text(description_prompt)
             
             return image_description if image_description else content[:200] + "..."
             
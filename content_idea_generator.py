@@ -107,7 +107,7 @@ Return ONLY the topic/title of the content idea, nothing else."""
             Provide a score (1-10) and brief feedback. Return in format: "Score: X/10 - Feedback: [brief feedback]"
             """
 
-            validation_result = await self.openai_handler.generate_text(validation_prompt)
+            validation_result = await self.openai_handler.generate_text(validation_prompt, temperature=0)
 
             # Extract score from response
             score = 5  # Default score
@@ -10,6 +10,21 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Leading bytes of the image formats we upload, mapped to their MIME type
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF8', 'image/gif'),
+)
+
+
+def _image_content_type(image_data: bytes) -> str:
+    """Detect the MIME type of image bytes from their signature, defaulting to PNG"""
+    for signature, content_type in IMAGE_SIGNATURES:
+        if image_data.startswith(signature):
+            return content_type
+    return 'image/png'
+
 
 class LinkedInAPI:
     def __init__(self, oauth_handler=None):
@@ -159,7 +174,7 @@ class LinkedInAPI:
         try:
             headers = {
                 "Authorization": f"Bearer {access_token}",
-                "Content-Type": "image/png"
+                "Content-Type": _image_content_type(image_data)
             }
 
             async with httpx.AsyncClient(timeout=60.0) as client:
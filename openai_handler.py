@@ -1,15 +1,99 @@
 import asyncio
 import logging
-from typing import Optional, Dict, Any
+import random
+from typing import Optional, Dict, Any, Callable, Awaitable, TypeVar, Union, TYPE_CHECKING
+import httpx
+import pybase64
 import openai
+from aiolimiter import AsyncLimiter
 from openai import AsyncOpenAI
 import os
 from dotenv import load_dotenv
+from response_cache import ResponseCache, SemanticCache, make_cache_key
+
+if TYPE_CHECKING:
+    import numpy as np
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
+# Sent unchanged as the first message of every text call. Keep it static and above 1024 tokens so
+# OpenAI prompt caching can reuse the prefix; request-specific text belongs in the user message.
+SYSTEM_PROMPT = """You are a professional LinkedIn content creator.
+
+You write for a professional audience on LinkedIn: founders, managers, engineers, marketers, recruiters, consultants and people early in their careers who use the platform to learn, to build their reputation and to find opportunities. Everything you produce is either published under a real person's name or used to decide what gets published, so it must be accurate, useful and something a thoughtful professional would be comfortable putting their name to.
+
+Following instructions:
+- The user message describes the task for this request: a post, a list of ideas, an evaluation, an analysis, an image description or something else. Follow its instructions exactly, including any required output format, length, scoring scale, labels or structure. When the user message conflicts with the defaults below, the user message wins.
+- Return only what was asked for. Do not add preambles such as "Sure, here is your post", closing offers of further help, explanations of your choices or notes to the editor unless the task asks for them.
+- When a format is specified, such as "Score: X/10 - Feedback: ...", reproduce it literally so that it can be parsed by software.
+- If the request is ambiguous, choose the most reasonable interpretation for a professional LinkedIn context and proceed without asking questions.
+
+Voice and tone:
+- Write in a confident, warm and human voice. Sound like an experienced practitioner sharing what they have learned, not like a press release, an advertisement or a textbook.
+- Prefer plain words over jargon. Use industry terms only when the audience would use them too, and explain anything specialised in a few words.
+- Be specific. Concrete numbers, named practices, short examples and clear takeaways are more valuable than general statements about innovation, synergy or the future of work.
+- Stay positive and constructive without being saccharine. Acknowledge trade-offs and difficulties honestly.
+- Avoid clichés and filler phrases such as "in today's fast-paced world", "game-changer", "unlock your potential", "let that sink in", "I'm humbled to announce" and "agree?".
+- Write in the first person singular when producing a post for an individual, unless the user message specifies otherwise.
+
+Writing LinkedIn posts (these rules apply only when the task is to write post text, never to ideas, evaluations, analyses or image prompts):
+- Open with a strong first line of at most about fifteen words that makes the reader want to click "see more". A surprising observation, a clear claim, a short story opening or a specific question all work well. Do not open with a greeting or with the author's name.
+- Keep paragraphs short: one to three sentences each, separated by a blank line, because most readers are on mobile.
+- Develop one main idea per post. Support it with a brief story, an example, data or a short list of practical points.
+- Use simple bulleted or numbered lists when presenting steps, lessons or options. Keep each list item to a single line where possible.
+- Close with a clear takeaway and, when natural, a specific question or invitation that encourages meaningful comments rather than generic engagement bait.
+- Aim for about 1,500 characters unless the user message asks for a different length, and never exceed LinkedIn's 3,000 character limit for a post.
+- Ask at most two questions in a post.
+
+Formatting conventions for post text:
+- LinkedIn does not render Markdown. Do not use headings, bold or italic markers, tables, code blocks or links written in Markdown syntax in post text.
+- Do not use emoji. Use a regular hyphen (-) instead of em dashes or long dashes.
+- Add exactly 3 relevant hashtags on the final line of a post, written in CamelCase when they contain several words, for example #RemoteWork or #CareerGrowth. Do not scatter hashtags through the body text.
+- Do not include URLs unless the user message provides them.
+
+Accuracy and integrity:
+- Do not invent statistics, studies, quotes, customers, employers, awards or personal experiences and present them as real. When illustrating a point without real data, describe it as an example, a typical case or a hypothetical.
+- Do not make medical, legal, financial or investment claims that could mislead readers. Keep such topics general and suggest consulting a qualified professional where appropriate.
+- Avoid content that is discriminatory, harassing, sexually explicit, politically inflammatory or that disparages named individuals or competitors.
+- Respect confidentiality: do not suggest revealing private company information, salaries of named people or other sensitive details.
+
+Ideas and topics:
+- Good LinkedIn topics are practical lessons, career advice, leadership and management insights, lessons from mistakes, behind-the-scenes stories of how work gets done, industry trends with a clear point of view, productivity and learning techniques, and celebrations of team achievements that credit others.
+- When proposing ideas, make each one specific enough to write a post from, with a clear angle, and vary them across formats such as story, how-to, list, opinion and question.
+
+Evaluations and analysis:
+- When asked to evaluate or score content, judge it against the criteria given in the user message, be honest rather than generous, keep feedback short and actionable, and follow the requested output format exactly.
+- When asked to analyse text, report observations that help improve engagement, clarity or professionalism rather than restating the text.
+
+Image descriptions:
+- When asked to describe or prompt an image for a post, describe a clean, professional, brand-safe visual with a clear subject, composition, colour palette and mood. Avoid text inside the image, logos, real people's likenesses and anything that would look out of place in a professional feed.
+- An image prompt is plain descriptive text for the image model. Do not add hashtags, questions, calls to action or any of the post writing rules above, and respect any length limit in the user message."""
+TEXT_MAX_TOKENS = 1000
+MAX_BACKOFF_SECONDS = 60
+
+# Calls above this temperature are meant to vary, so they are only cached on explicit opt-in
+CACHE_MAX_TEMPERATURE = 0.3
+CACHE_MAX_SIZE = 512
+CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', str(6 * 60 * 60)))
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95'))
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
+OPENAI_RPM = int(os.getenv('OPENAI_RPM', '60'))
+
+# Requested once at startup so DNS, TLS and the HTTP/2 connection are ready for the first call
+WARMUP_URL = 'https://api.openai.com/'
+
+# Shared by every handler instance so identical prompts hit across writers/generators
+response_cache = ResponseCache(CACHE_MAX_SIZE, CACHE_TTL_SECONDS)
+semantic_cache = SemanticCache(CACHE_MAX_SIZE, CACHE_TTL_SECONDS, SEMANTIC_CACHE_THRESHOLD)
+
+# Process-wide request budget so all handlers together stay under the account's RPM limit
+request_limiter = AsyncLimiter(OPENAI_RPM, 60)
+
 
 class OpenAIHandler:
     def __init__(self):
@@ -18,7 +102,12 @@ class OpenAIHandler:
             if not self.api_key:
                 raise ValueError("OPENAI_API_KEY not found in environment variables")
 
-            self.client = AsyncOpenAI(api_key=self.api_key)
+            # Explicit pool so chat and image calls share keep-alive HTTP/2 connections
+            self.http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+                http2=True
+            )
+            self.client = AsyncOpenAI(api_key=self.api_key, http_client=self.http_client)
             self.text_model = os.getenv('TEXT_MODEL', 'gpt-4-turbo-preview')
             self.image_model = os.getenv('IMAGE_MODEL', 'dall-e-2')  # Use cheaper model by default
             self.max_retries = int(os.getenv('MAX_RETRIES', '3'))
@@ -30,110 +119,223 @@ class OpenAIHandler:
             logger.error(f"Failed to initialize OpenAI Handler: {str(e)}")
             raise
 
-    async def generate_text(self, prompt: str, model: Optional[str] = None) -> Optional[str]:
-        """Generate text content using OpenAI API"""
+    async def __aenter__(self) -> "OpenAIHandler":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.aclose()
+
+    async def warmup(self) -> None:
+        """Resolve DNS and open a pooled connection to the API ahead of the first request"""
         try:
-            model_to_use = model or self.text_model
+            await self.http_client.get(WARMUP_URL, timeout=2.0)
+            logger.info("OpenAI Handler connection pool warmed up")
+        except Exception as e:
+            logger.warning(f"OpenAI Handler warmup failed: {str(e)}")
 
-            for attempt in range(self.max_retries):
-                try:
-                    response = await self.client.chat.completions.create(
-                        model=model_to_use,
-                        messages=[
-                            {"role": "system", "content": "You are a professional LinkedIn content creator."},
-                            {"role": "user", "content": prompt}
-                        ],
-                        max_tokens=1000,
-                        temperature=0.7
-                    )
-
-                    content = response.choices[0].message.content
-                    logger.info(f"Text generated successfully with model: {model_to_use}")
-                    return content.strip()
-
-                except openai.RateLimitError as e:
-                    logger.warning(f"Rate limit hit on attempt {attempt + 1}: {str(e)}")
-                    if attempt < self.max_retries - 1:
-                        await asyncio.sleep(self.retry_delay * (attempt + 1))
-                        continue
-                    raise
+    async def aclose(self) -> None:
+        """Close the pooled HTTP connections"""
+        await self.client.close()
 
-                except openai.APIError as e:
-                    logger.error(f"OpenAI API error on attempt {attempt + 1}: {str(e)}")
-                    if attempt < self.max_retries - 1:
-                        await asyncio.sleep(self.retry_delay)
-                        continue
-                    raise
+    async def generate_text(self, prompt: str, model: Optional[str] = None, temperature: float = 0.7,
+                            use_cache: Optional[bool] = None) -> Optional[str]:
+        """Generate text content using OpenAI API
+
+        Responses are cached when temperature <= CACHE_MAX_TEMPERATURE, or when use_cache is True.
+        """
+        model_to_use = model or self.text_model
+        if use_cache is None:
+            use_cache = temperature <= CACHE_MAX_TEMPERATURE
+
+        if not use_cache:
+            return await self._request_text(prompt, model_to_use, temperature)
+
+        scope = make_cache_key(model_to_use, SYSTEM_PROMPT, TEXT_MAX_TOKENS, round(temperature, 2))
+        return await self._cached(
+            make_cache_key(scope, prompt),
+            lambda: self._request_text(prompt, model_to_use, temperature),
+            semantic_scope=scope,
+            semantic_text=prompt
+        )
+
+    async def _request_text(self, prompt: str, model_to_use: str, temperature: float) -> Optional[str]:
+        """Call the chat completions API with retries"""
+        try:
+            response = await self._call_with_retry(
+                lambda: self.client.chat.completions.create(
+                    model=model_to_use,
+                    messages=[
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=TEXT_MAX_TOKENS,
+                    temperature=temperature
+                ),
+                "text"
+            )
+
+            content = response.choices[0].message.content
+            logger.info(f"Text generated successfully with model: {model_to_use}")
+            self._log_prompt_cache_usage(response)
+            return content.strip()
 
         except Exception as e:
             logger.error(f"Failed to generate text: {str(e)}")
             return None
 
-    async def generate_image(self, prompt: str, model: Optional[str] = None) -> Optional[str]:
-        """Generate image using DALL-E API"""
+    def _log_prompt_cache_usage(self, response: Any) -> None:
+        """Log how many prompt tokens OpenAI served from its prompt cache"""
+        usage = getattr(response, 'usage', None)
+        details = getattr(usage, 'prompt_tokens_details', None)
+        # Older SDK versions keep fields they do not model as plain dicts
+        if isinstance(details, dict):
+            cached_tokens = details.get('cached_tokens')
+        else:
+            cached_tokens = getattr(details, 'cached_tokens', None)
+        if cached_tokens:
+            logger.info(f"Prompt cache hit: {cached_tokens}/{usage.prompt_tokens} prompt tokens cached")
+
+    async def generate_image(self, prompt: str, model: Optional[str] = None, use_cache: bool = False) -> Optional[Union[bytes, str]]:
+        """Generate image using DALL-E API, returns raw image bytes or a URL; cached only when use_cache is True"""
+        model_to_use = model or self.image_model
+        image_size = os.getenv('IMAGE_SIZE', '1024x1024')
+        image_quality = os.getenv('IMAGE_QUALITY', 'standard')
+
+        if not use_cache:
+            return await self._request_image(prompt, model_to_use, image_size, image_quality)
+
+        return await self._cached(
+            make_cache_key("image", model_to_use, prompt, image_size, image_quality),
+            lambda: self._request_image(prompt, model_to_use, image_size, image_quality)
+        )
+
+    async def _request_image(self, prompt: str, model_to_use: str, image_size: str,
+                             image_quality: str) -> Optional[Union[bytes, str]]:
+        """Call the image generation API with retries"""
         try:
-            model_to_use = model or self.image_model
-            image_size = os.getenv('IMAGE_SIZE', '1024x1024')
-            image_quality = os.getenv('IMAGE_QUALITY', 'standard')
+            # Prepare parameters
+            params = {
+                "model": model_to_use,
+                "prompt": prompt,
+                "size": image_size,
+                "n": 1
+            }
 
-            for attempt in range(self.max_retries):
-                try:
-                    # Prepare parameters
-                    params = {
-                        "model": model_to_use,
-                        "prompt": prompt,
-                        "size": image_size,
-                        "n": 1
-                    }
-                    
-                    # Only add response_format for models that support it
-                    if model_to_use in ["dall-e-2", "dall-e-3"]:
-                        params["response_format"] = "b64_json"  # Get base64 data instead of URL
-                    
-                    # Only add quality parameter for dall-e-3
-                    if model_to_use == "dall-e-3":
-                        params["quality"] = image_quality
-
-                    response = await self.client.images.generate(**params)
-
-                    # Handle different response formats based on model
-                    if model_to_use in ["dall-e-2", "dall-e-3"] and "response_format" in params:
-                        # Return base64 data for DALL-E models
-                        image_data = response.data[0].b64_json
-                        logger.info(f"Image generated successfully with model: {model_to_use} (base64)")
-                        return image_data
-                    else:
-                        # Return URL for other models (like gpt-image-1)
-                        image_url = response.data[0].url
-                        logger.info(f"Image generated successfully with model: {model_to_use} (URL)")
-                        return image_url
-
-                except openai.RateLimitError as e:
-                    logger.warning(f"Rate limit hit on attempt {attempt + 1}: {str(e)}")
-                    if attempt < self.max_retries - 1:
-                        await asyncio.sleep(self.retry_delay * (attempt + 1))
-                        continue
+            # Only add response_format for models that support it
+            if model_to_use in ["dall-e-2", "dall-e-3"]:
+                params["response_format"] = "b64_json"  # Get base64 data instead of URL
+
+            # Only add quality parameter for dall-e-3
+            if model_to_use == "dall-e-3":
+                params["quality"] = image_quality
+
+            response = await self._call_with_retry(lambda: self.client.images.generate(**params), "image")
+
+            # Handle different response formats based on model
+            if model_to_use in ["dall-e-2", "dall-e-3"] and "response_format" in params:
+                # Decode once here so callers get raw bytes instead of the larger base64 string
+                image_data = pybase64.b64decode(response.data[0].b64_json, validate=False)
+                logger.info(f"Image generated successfully with model: {model_to_use} (bytes)")
+                return image_data
+            else:
+                # Return URL for other models (like gpt-image-1)
+                image_url = response.data[0].url
+                logger.info(f"Image generated successfully with model: {model_to_use} (URL)")
+                return image_url
+
+        except Exception as e:
+            logger.error(f"Failed to generate image: {str(e)}")
+            return None
+
+    async def _call_with_retry(self, make_call: Callable[[], Awaitable[T]], label: str) -> T:
+        """Run an OpenAI call, retrying rate limits and API errors with backoff"""
+        for attempt in range(self.max_retries):
+            try:
+                async with request_limiter:
+                    return await make_call()
+
+            except openai.RateLimitError as e:
+                logger.warning(f"Rate limit hit on {label} attempt {attempt + 1}: {str(e)}")
+                if attempt == self.max_retries - 1:
                     raise
+                await self._sleep_backoff(attempt, e)
 
-                except openai.APIError as e:
-                    logger.error(f"OpenAI API error on attempt {attempt + 1}: {str(e)}")
-                    if attempt < self.max_retries - 1:
-                        await asyncio.sleep(self.retry_delay)
-                        continue
+            except openai.APIError as e:
+                logger.error(f"OpenAI API error on {label} attempt {attempt + 1}: {str(e)}")
+                if attempt == self.max_retries - 1:
                     raise
+                await self._sleep_backoff(attempt, e)
+
+    async def _sleep_backoff(self, attempt: int, exc: Exception) -> None:
+        """Sleep before a retry, honoring Retry-After or using jittered exponential backoff"""
+        delay = None
+        response = getattr(exc, 'response', None)
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    delay = float(retry_after)
+                except ValueError:
+                    delay = None
+
+        if delay is None:
+            # Random spread keeps concurrent clients from retrying in lockstep
+            delay = random.uniform(self.retry_delay, self.retry_delay * 3 * (2 ** attempt))
+
+        await asyncio.sleep(min(delay, MAX_BACKOFF_SECONDS))
+
+    async def _cached(self, key: str, make_call: Callable[[], Awaitable[Optional[T]]],
+                      semantic_scope: Optional[str] = None, semantic_text: Optional[str] = None) -> Optional[T]:
+        """Serve a response from the cache, or make the call once and cache a successful result"""
+        cached = response_cache.get(key)
+        if cached is not None:
+            logger.info("Response served from cache")
+            return cached
+
+        async with response_cache.coalesce(key):
+            # A concurrent identical call may have filled the cache while we waited
+            cached = response_cache.get(key)
+            if cached is not None:
+                logger.info("Response served from cache")
+                return cached
+
+            vector = None
+            if SEMANTIC_CACHE_ENABLED and semantic_text is not None:
+                vector = await self._embed(semantic_text)
+                if vector is not None:
+                    cached = semantic_cache.lookup(semantic_scope, vector)
+                    if cached is not None:
+                        return cached
+
+            result = await make_call()
+            if result is not None:
+                response_cache.set(key, result)
+                if vector is not None:
+                    semantic_cache.add(semantic_scope, vector, result)
+            return result
+
+    async def _embed(self, text: str) -> Optional["np.ndarray"]:
+        """Embed text for the semantic cache as a unit-length vector"""
+        try:
+            async with request_limiter:
+                response = await self.client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+            import numpy as np
+            vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+            return vector / np.linalg.norm(vector)
 
         except Exception as e:
-            logger.error(f"Failed to generate image: {str(e)}")
+            logger.warning(f"Failed to embed prompt for semantic cache: {str(e)}")
             return None
 
     async def health_check(self) -> Dict[str, Any]:
         """Check OpenAI API health"""
         try:
-            response = await self.client.chat.completions.create(
-                model=self.text_model,
-                messages=[{"role": "user", "content": "Hi"}],
-                max_tokens=10
-            )
+            async with request_limiter:
+                response = await self.client.chat.completions.create(
+                    model=self.text_model,
+                    messages=[{"role": "user", "content": "Hi"}],
+                    max_tokens=10
+                )
 
             return {
                 "status": "healthy",
@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(*parts: Any) -> str:
+    """Build a compact cache key from request parameters"""
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+class ResponseCache:
+    """In-process LRU + TTL cache for API responses"""
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, Tuple[Any, float]] = OrderedDict()
+        self._inflight: Dict[str, asyncio.Event] = {}
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return a cached value, or None if missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a value, evicting the least recently used entries over maxsize"""
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    @asynccontextmanager
+    async def coalesce(self, key: str) -> AsyncIterator[None]:
+        """Single-flight guard: concurrent callers for the same key wait for the first one to finish"""
+        while (pending := self._inflight.get(key)) is not None:
+            await pending.wait()
+
+        event = asyncio.Event()
+        self._inflight[key] = event
+        try:
+            yield
+        finally:
+            del self._inflight[key]
+            event.set()
+
+
+class SemanticCache:
+    """Near-duplicate cache matching prompt embeddings by cosine similarity
+
+    numpy is imported on first use so the default, disabled configuration does not load it.
+    """
+
+    def __init__(self, maxsize: int, ttl_seconds: float, threshold: float):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        # Unit-length embeddings, one row per entry, allocated on first insert
+        self._vectors: Optional["np.ndarray"] = None
+        # (scope, value, expires_at) for each row of _vectors
+        self._entries: List[Tuple[str, Any, float]] = []
+        self._next_row = 0
+
+    def lookup(self, scope: str, vector: "np.ndarray") -> Optional[Any]:
+        """Return the value of the most similar live entry in scope above the threshold"""
+        if self._vectors is None:
+            return None
+
+        import numpy as np
+
+        now = time.monotonic()
+        scores = self._vectors[:len(self._entries)] @ vector
+        for row in np.argsort(scores)[::-1]:
+            if scores[row] < self.threshold:
+                break
+            entry_scope, value, expires_at = self._entries[row]
+            if entry_scope == scope and expires_at > now:
+                logger.info(f"Semantic cache hit (similarity {scores[row]:.3f})")
+                return value
+
+        return None
+
+    def add(self, scope: str, vector: "np.ndarray", value: Any) -> None:
+        """Store a value, overwriting the oldest entry once maxsize is reached"""
+        if self._vectors is None:
+            import numpy as np
+            self._vectors = np.zeros((self.maxsize, vector.shape[0]), dtype=np.float32)
+
+        row = self._next_row
+        self._vectors[row] = vector
+        entry = (scope, value, time.monotonic() + self.ttl_seconds)
+        if row < len(self._entries):
+            self._entries[row] = entry
+        else:
+            self._entries.append(entry)
+        self._next_row = (row + 1) % self.maxsize
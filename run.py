@@ -5,33 +5,55 @@ Script to run the LinkedIn content automation pipeline via API
 
 import os
 import asyncio
-import subprocess
+import time
 
 import aiohttp
-import json
+import orjson
 import sys
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-async def check_server_running(host: str, port: str) -> bool:
+# Verbose response dumps (headers, full JSON body) are only printed in debug mode
+DEBUG_MODE = os.getenv('DEBUG_MODE', 'false').lower() == 'true'
+
+# Health checks on a freshly started server back off from the min to the max interval (seconds)
+SERVER_POLL_MIN_INTERVAL = 0.05
+SERVER_POLL_MAX_INTERVAL = 1.0
+SERVER_START_TIMEOUT = 20  # seconds
+
+# Bytes read per chunk from the server's stdout/stderr pipes
+LOG_CHUNK_SIZE = 65536
+
+# Keeps references to the server log pumps so they are not garbage collected
+_log_tasks = set()
+
+async def check_server_running(session: aiohttp.ClientSession, host: str, port: str) -> bool:
     """Check if the server is running by making a health check request"""
     try:
         timeout = aiohttp.ClientTimeout(total=5)  # 5 second timeout for health check
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            health_url = f"http://{host}:{port}/api/v1/health-check"
-            async with session.get(health_url) as response:
-                return response.status == 200
+        health_url = f"http://{host}:{port}/api/v1/health-check"
+        async with session.get(health_url, timeout=timeout) as response:
+            return response.status == 200
     except:
         return False
 
-def start_server(host: str, port: str):
+async def _drain(stream: asyncio.StreamReader, prefix: str) -> None:
+    """Print server log lines as they arrive on the event loop"""
+    # Read fixed-size chunks rather than lines, so an oversized line cannot stop the
+    # pump and leave the server blocked on a full pipe
+    pending = b""
+    while chunk := await stream.read(LOG_CHUNK_SIZE):
+        *lines, pending = (pending + chunk).split(b"\n")
+        for line in lines:
+            print(f"{prefix} {line.decode(errors='replace').rstrip()}")
+    if pending:
+        print(f"{prefix} {pending.decode(errors='replace').rstrip()}")
+
+async def start_server(host: str, port: str) -> asyncio.subprocess.Process:
     """Start the server using uvicorn with venv activation"""
-    import subprocess
-    import time
     import platform
-    import threading
     
     print(f"🚀 Starting server on {host}:{port}...")
     
@@ -48,38 +70,38 @@ def start_server(host: str, port: str):
     print(f"🔧 Activating venv and starting server: {shell_cmd}")
     
     # Start server in background with venv activation
-    process = subprocess.Popen(
+    process = await asyncio.create_subprocess_shell(
         shell_cmd,
-        shell=True,
-        stdout=subprocess.PIPE, 
-        stderr=subprocess.PIPE,
-        text=True,
-        bufsize=1,
-        universal_newlines=True
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
     )
     
-    # Function to read and print server logs
-    def print_server_logs(stream, prefix):
-        try:
-            for line in iter(stream.readline, ''):
-                if line:
-                    print(f"{prefix} {line.rstrip()}")
-        except:
-            pass
-    
-    # Start threads to capture server logs
-    stdout_thread = threading.Thread(target=print_server_logs, args=(process.stdout, "📝 [SERVER]"))
-    stderr_thread = threading.Thread(target=print_server_logs, args=(process.stderr, "⚠️  [SERVER ERROR]"))
-    stdout_thread.daemon = True
-    stderr_thread.daemon = True
-    stdout_thread.start()
-    stderr_thread.start()
-    
-    # Wait a bit for server to start
-    time.sleep(3)
+    # Pump server logs on the running loop instead of reader threads
+    for stream, prefix in ((process.stdout, "📝 [SERVER]"), (process.stderr, "⚠️  [SERVER ERROR]")):
+        log_task = asyncio.create_task(_drain(stream, prefix))
+        _log_tasks.add(log_task)
+        log_task.add_done_callback(_log_tasks.discard)
     
     return process
 
+async def stop_server(process: asyncio.subprocess.Process) -> None:
+    """Stop the server process, its log pumps and pipes before the event loop shuts down"""
+    process.terminate()
+    try:
+        await asyncio.wait_for(process.wait(), timeout=5)
+    except asyncio.TimeoutError:
+        process.kill()
+
+    for log_task in list(_log_tasks):
+        log_task.cancel()
+    await asyncio.gather(*_log_tasks, return_exceptions=True)
+
+    # A backgrounded uvicorn outlives the shell and keeps the pipes open, so the transport has
+    # to be closed here; asyncio.subprocess.Process has no public close for it
+    transport = getattr(process, '_transport', None)
+    if transport is not None:
+        transport.close()
+
 async def run_automation():
     """Run the content automation pipeline via API"""
     
@@ -91,26 +113,40 @@ async def run_automation():
     if not auth_token:
         print("❌ Error: BASIC_AUTH_TOKEN environment variable is required")
         sys.exit(1)
-    
+
+    timeout_seconds = 60*10  # seconds
+
+    # One session for the health checks and the automation request, so connections are reused
+    async with aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=timeout_seconds),
+        connector=aiohttp.TCPConnector(limit=32, keepalive_timeout=60)
+    ) as session:
+        return await _run_automation(session, host, port, auth_token, timeout_seconds)
+
+async def _run_automation(session: aiohttp.ClientSession, host: str, port: str, auth_token: str, timeout_seconds: int):
+    """Run the automation steps over a shared HTTP session"""
     # Check if server is running
     print(f"🔍 Checking if server is running on {host}:{port}...")
-    server_running = await check_server_running(host, port)
+    server_running = await check_server_running(session, host, port)
     
     server_process = None
     if not server_running:
         print("⚠️  Server is not running. Starting it now...")
-        server_process = start_server(host, port)
+        server_process = await start_server(host, port)
         
-        # Wait for server to be ready
-        for attempt in range(10):  # Try for 10 attempts
-            await asyncio.sleep(2)
-            if await check_server_running(host, port):
+        # Wait for server to be ready, polling quickly at first since most starts take under a second
+        delay = SERVER_POLL_MIN_INTERVAL
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if await check_server_running(session, host, port):
                 print("✅ Server is now running!")
                 break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, SERVER_POLL_MAX_INTERVAL)
         else:
             print("❌ Failed to start server or server not responding")
             if server_process:
-                server_process.terminate()
+                await stop_server(server_process)
             sys.exit(1)
     else:
         print("✅ Server is already running!")
@@ -133,52 +169,51 @@ async def run_automation():
         "Authorization": f"Bearer {auth_token}"
     }
 
-    timeout_seconds = 60*10  # seconds
-
     print(f"🚀 Starting LinkedIn content automation...")
     print(f"📡 API URL: {api_url}")
-    print(f"⚙️  Configuration: {json.dumps(payload, indent=2)}")
+    print(f"⚙️  Configuration: {orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode()}")
     print(f"⏱️  Timeout: {timeout_seconds} seconds")
     print("-" * 50)
     
     try:
-        # Create timeout context
-        timeout = aiohttp.ClientTimeout(total=timeout_seconds)  # timeout seconds
-        
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            print("📡 Making API request...")
-            async with session.post(api_url, json=payload, headers=headers) as response:
-                print(f"📊 Response Status: {response.status}")
-                print(f"📊 Response Headers: {dict(response.headers)}")
-                
-                # Read response content
-                response_text = await response.text()
-                print(f"📊 Response Size: {len(response_text)} characters")
+        print("📡 Making API request...")
+        async with session.post(api_url, json=payload, headers=headers) as response:
+            print(f"📊 Response Status: {response.status}")
+            if DEBUG_MODE:
+                print("📊 Response Headers:")
+                for name, value in response.headers.items():
+                    print(f"   {name}: {value}")
+            
+            # Read response content
+            response_text = await response.text()
+            print(f"📊 Response Size: {len(response_text)} characters")
+            
+            response_json = {}
+            try:
+                response_json = orjson.loads(response_text)
+                if DEBUG_MODE:
+                    print(f"📋 Response JSON: {orjson.dumps(response_json, option=orjson.OPT_INDENT_2).decode()}")
                 
-                try:
-                    response_json = json.loads(response_text)
-                    print(f"📋 Response JSON: {json.dumps(response_json, indent=2)}")
+                # Print detailed pipeline information if available
+                if response_json.get("pipeline_id"):
+                    print(f"🆔 Pipeline ID: {response_json['pipeline_id']}")
+                if response_json.get("stages"):
+                    print(f"📋 Pipeline Stages: {response_json['stages']}")
+                if response_json.get("estimated_duration"):
+                    print(f"⏱️  Estimated Duration: {response_json['estimated_duration']}")
                     
-                    # Print detailed pipeline information if available
-                    if response_json.get("pipeline_id"):
-                        print(f"🆔 Pipeline ID: {response_json['pipeline_id']}")
-                    if response_json.get("stages"):
-                        print(f"📋 Pipeline Stages: {response_json['stages']}")
-                    if response_json.get("estimated_duration"):
-                        print(f"⏱️  Estimated Duration: {response_json['estimated_duration']}")
-                        
-                except json.JSONDecodeError:
-                    print(f"📋 Response (raw): {response_text}")
+            except orjson.JSONDecodeError:
+                print(f"📋 Response (raw): {response_text}")
+            
+            if response.status == 200:
+                print("✅ Automation pipeline completed successfully!")
+                return True
+            else:
+                print(f"❌ Automation pipeline failed with status {response.status}")
+                if response_json.get("error"):
+                    print(f"❌ Error Details: {response_json['error']}")
+                return False
                 
-                if response.status == 200:
-                    print("✅ Automation pipeline completed successfully!")
-                    return True
-                else:
-                    print(f"❌ Automation pipeline failed with status {response.status}")
-                    if response_json.get("error"):
-                        print(f"❌ Error Details: {response_json['error']}")
-                    return False
-                    
     except asyncio.TimeoutError:
         print("⏰ Error: Request timed out after 180 seconds")
         return False
@@ -193,11 +228,7 @@ async def run_automation():
         # Clean up server process if we started it
         if server_process:
             print("🛑 Stopping server...")
-            server_process.terminate()
-            try:
-                server_process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                server_process.kill()
+            await stop_server(server_process)
             print("✅ Server stopped")
 
 def main():
@@ -1,17 +1,47 @@
 import asyncio
+import heapq
 import logging
+import random
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List, Callable
+from typing import Optional, Dict, Any, List, Callable, Tuple, Set
 import json
 import os
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, field, asdict
 from enum import Enum
+import aiosqlite
 from dotenv import load_dotenv
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+SCHEDULER_DB_PATH = os.getenv('SCHEDULER_DB_PATH', 'scheduler.db')
+SCHEDULER_RETENTION_DAYS = int(os.getenv('SCHEDULER_RETENTION_DAYS', '7'))
+PURGE_INTERVAL_SECONDS = 3600
+
+CREATE_TASKS_TABLE = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    task_type TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    scheduled_time REAL NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    completed_at REAL,
+    error_message TEXT,
+    retry_count INTEGER NOT NULL DEFAULT 0,
+    max_retries INTEGER NOT NULL DEFAULT 3
+)
+"""
+CREATE_TASKS_INDEX = "CREATE INDEX IF NOT EXISTS idx_tasks_status_time ON tasks (status, scheduled_time)"
+UPSERT_TASK = """
+INSERT OR REPLACE INTO tasks (task_id, task_type, payload, scheduled_time, status, created_at,
+                              started_at, completed_at, error_message, retry_count, max_retries)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+FINISHED_STATUSES = ("completed", "cancelled", "failed")
+
 
 class TaskStatus(Enum):
     PENDING = "pending"
@@ -21,7 +51,22 @@ class TaskStatus(Enum):
     CANCELLED = "cancelled"
 
 
-@dataclass
+# Bound once so the scheduling hot path skips the enum attribute lookups
+PENDING = TaskStatus.PENDING
+RUNNING = TaskStatus.RUNNING
+COMPLETED = TaskStatus.COMPLETED
+FAILED = TaskStatus.FAILED
+
+# Datetime fields whose ISO string is cached beside them, mapped to the cache attribute
+ISO_FIELDS = {
+    "scheduled_time": "scheduled_time_iso",
+    "created_at": "created_at_iso",
+    "started_at": "started_at_iso",
+    "completed_at": "completed_at_iso",
+}
+
+
+@dataclass(slots=True)
 class ScheduledTask:
     task_id: str
     task_type: str
@@ -34,10 +79,25 @@ class ScheduledTask:
     error_message: Optional[str] = None
     retry_count: int = 0
     max_retries: int = 3
+    scheduled_time_iso: Optional[str] = field(default=None, init=False, repr=False)
+    created_at_iso: Optional[str] = field(default=None, init=False, repr=False)
+    started_at_iso: Optional[str] = field(default=None, init=False, repr=False)
+    completed_at_iso: Optional[str] = field(default=None, init=False, repr=False)
+    # Event loop clock reading at which the task is due, compared on the scheduling hot path
+    scheduled_time_monotonic: float = field(default=0.0, init=False, repr=False)
 
     def __post_init__(self):
         if self.created_at is None:
             self.created_at = datetime.now()
+        # __init__ resets the cached strings after the datetimes are set, so fill them here
+        for name in ISO_FIELDS:
+            setattr(self, name, getattr(self, name))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        object.__setattr__(self, name, value)
+        iso_name = ISO_FIELDS.get(name)
+        if iso_name:
+            object.__setattr__(self, iso_name, value.isoformat() if value else None)
 
 
 class ContentScheduler:
@@ -45,10 +105,27 @@ class ContentScheduler:
         try:
             self.tasks: Dict[str, ScheduledTask] = {}
             self.running_tasks: Dict[str, asyncio.Task] = {}
+            # Ids of running_tasks, kept in step with it for membership checks
+            self._running_ids: Set[str] = set()
+            # Guards mutations of tasks/running_tasks and the snapshots taken for iteration
+            self._lock = asyncio.Lock()
+            # Min-heap of (scheduled_time_monotonic, task_id); stale entries are skipped when popped
+            self._pending_heap: List[Tuple[float, str]] = []
+            # Set whenever the schedule changes so the loop re-evaluates its next deadline
+            self._wakeup = asyncio.Event()
             self.max_retries = int(os.getenv('MAX_RETRIES', '3'))
             self.retry_delay = int(os.getenv('RETRY_DELAY', '5'))
             self.scheduler_running = False
             self.scheduler_task = None
+            self.purge_task = None
+
+            # Tasks are written through to sqlite so they survive restarts
+            self._db: Optional[aiosqlite.Connection] = None
+
+            # Caps how many due tasks execute at once; the rest wait for a slot
+            self._exec_sem = asyncio.Semaphore(int(os.getenv('MAX_CONCURRENT_TASKS', '8')))
+            # Same cap for the items of batch tasks; separate so a task holding a slot cannot starve its own items
+            self._item_sem = asyncio.Semaphore(int(os.getenv('MAX_CONCURRENT_TASKS', '8')))
 
             # Task callbacks - will be set by main application
             self.task_callbacks: Dict[str, Callable] = {}
@@ -65,8 +142,11 @@ class ContentScheduler:
             if self.scheduler_running:
                 return {"status": "already_running", "message": "Scheduler is already active"}
 
+            await self._open_store()
+
             self.scheduler_running = True
             self.scheduler_task = asyncio.create_task(self._scheduler_loop())
+            self.purge_task = asyncio.create_task(self._purge_loop())
 
             logger.info("Content scheduler started successfully")
             return {"status": "started", "message": "Scheduler started successfully"}
@@ -83,19 +163,27 @@ class ContentScheduler:
 
             self.scheduler_running = False
 
-            if self.scheduler_task:
-                self.scheduler_task.cancel()
-                try:
-                    await self.scheduler_task
-                except asyncio.CancelledError:
-                    pass
+            for background_task in (self.scheduler_task, self.purge_task):
+                if background_task:
+                    background_task.cancel()
+                    try:
+                        await background_task
+                    except asyncio.CancelledError:
+                        pass
 
             # Cancel all running tasks
-            for task_id, task in self.running_tasks.items():
+            async with self._lock:
+                running = list(self.running_tasks.items())
+                self.running_tasks.clear()
+                self._running_ids.clear()
+
+            for task_id, task in running:
                 task.cancel()
                 logger.info(f"Cancelled running task: {task_id}")
 
-            self.running_tasks.clear()
+            if self._db:
+                await self._db.close()
+                self._db = None
 
             logger.info("Content scheduler stopped successfully")
             return {"status": "stopped", "message": "Scheduler stopped successfully"}
@@ -132,14 +220,18 @@ class ContentScheduler:
                 max_retries=self.max_retries
             )
 
-            self.tasks[task_id] = task
+            async with self._lock:
+                self.tasks[task_id] = task
+            await self._persist_task(task)
+            self._push_pending(task)
+            self._wakeup.set()
 
             logger.info(f"Post creation scheduled: {task_id} at {scheduled_time}")
 
             return {
                 "success": True,
                 "task_id": task_id,
-                "scheduled_time": scheduled_time.isoformat(),
+                "scheduled_time": task.scheduled_time_iso,
                 "status": "scheduled"
             }
 
@@ -163,14 +255,17 @@ class ContentScheduler:
 
             task = self.tasks[task_id]
 
-            # Cancel running task if exists
-            if task_id in self.running_tasks:
-                self.running_tasks[task_id].cancel()
-                del self.running_tasks[task_id]
+            # Cancel running task if exists and update its status as one transition
+            async with self._lock:
+                running = self.running_tasks.pop(task_id, None)
+                self._running_ids.discard(task_id)
+                task.status = TaskStatus.CANCELLED
+                task.completed_at = datetime.now()
+            if running:
+                running.cancel()
 
-            # Update task status
-            task.status = TaskStatus.CANCELLED
-            task.completed_at = datetime.now()
+            await self._persist_task(task)
+            self._wakeup.set()
 
             logger.info(f"Task cancelled: {task_id}")
 
@@ -178,7 +273,7 @@ class ContentScheduler:
                 "success": True,
                 "task_id": task_id,
                 "status": "cancelled",
-                "cancelled_at": task.completed_at.isoformat()
+                "cancelled_at": task.completed_at_iso
             }
 
         except Exception as e:
@@ -206,14 +301,14 @@ class ContentScheduler:
                 "task_id": task.task_id,
                 "status": task.status.value,
                 "task_type": task.task_type,
-                "scheduled_time": task.scheduled_time.isoformat(),
-                "created_at": task.created_at.isoformat(),
-                "started_at": task.started_at.isoformat() if task.started_at else None,
-                "completed_at": task.completed_at.isoformat() if task.completed_at else None,
+                "scheduled_time": task.scheduled_time_iso,
+                "created_at": task.created_at_iso,
+                "started_at": task.started_at_iso,
+                "completed_at": task.completed_at_iso,
                 "retry_count": task.retry_count,
                 "max_retries": task.max_retries,
                 "error_message": task.error_message,
-                "is_running": task_id in self.running_tasks
+                "is_running": task_id in self._running_ids
             }
 
         except Exception as e:
@@ -229,7 +324,11 @@ class ContentScheduler:
         try:
             tasks_list = []
 
-            for task in self.tasks.values():
+            # Iterate a snapshot so concurrent scheduling cannot resize the dict mid-loop
+            async with self._lock:
+                tasks_snapshot = list(self.tasks.values())
+
+            for task in tasks_snapshot:
                 if status_filter and task.status.value != status_filter:
                     continue
 
@@ -237,10 +336,10 @@ class ContentScheduler:
                     "task_id": task.task_id,
                     "status": task.status.value,
                     "task_type": task.task_type,
-                    "scheduled_time": task.scheduled_time.isoformat(),
-                    "created_at": task.created_at.isoformat(),
+                    "scheduled_time": task.scheduled_time_iso,
+                    "created_at": task.created_at_iso,
                     "retry_count": task.retry_count,
-                    "is_running": task.task_id in self.running_tasks
+                    "is_running": task.task_id in self._running_ids
                 }
 
                 if task.error_message:
@@ -301,21 +400,27 @@ class ContentScheduler:
 
     def register_task_callback(self, task_type: str, callback: Callable) -> None:
         """Register a callback function for a specific task type"""
+        # Callbacks with supports_batch = True get one call per entry of payload["items"]
         self.task_callbacks[task_type] = callback
         logger.info(f"Registered callback for task type: {task_type}")
 
     async def _scheduler_loop(self) -> None:
         """Main scheduler loop that runs in the background"""
         try:
+            consecutive_errors = 0
             while self.scheduler_running:
                 try:
                     await self._process_due_tasks()
-                    await asyncio.sleep(30)  # Check every 30 seconds
+                    await self._wait_for_next_task()
+                    consecutive_errors = 0
                 except asyncio.CancelledError:
                     break
                 except Exception as e:
                     logger.error(f"Error in scheduler loop: {str(e)}")
-                    await asyncio.sleep(60)  # Wait longer on error
+                    # Back off exponentially with jitter while errors keep repeating
+                    delay = min(300, 5 * 2 ** consecutive_errors) * random.uniform(0.5, 1.5)
+                    consecutive_errors += 1
+                    await asyncio.sleep(delay)
 
         except asyncio.CancelledError:
             logger.info("Scheduler loop cancelled")
@@ -325,15 +430,25 @@ class ContentScheduler:
     async def _process_due_tasks(self) -> None:
         """Process tasks that are due for execution"""
         try:
-            current_time = datetime.now()
+            current_time = asyncio.get_running_loop().time()
+
+            async with self._lock:
+                # Only pop tasks whose time has arrived instead of scanning every task
+                while self._pending_heap and self._pending_heap[0][0] <= current_time:
+                    due_time, task_id = heapq.heappop(self._pending_heap)
+                    task = self.tasks.get(task_id)
+
+                    # Skip entries left behind by cancelled, finished or rescheduled tasks
+                    if (task is None or
+                            task.status is not PENDING or
+                            task.scheduled_time_monotonic != due_time or
+                            task_id in self._running_ids):
+                        continue
 
-            for task_id, task in self.tasks.items():
-                if (task.status == TaskStatus.PENDING and
-                        task.scheduled_time <= current_time and
-                        task_id not in self.running_tasks):
                     # Start the task
                     task_coroutine = self._execute_task(task_id)
                     self.running_tasks[task_id] = asyncio.create_task(task_coroutine)
+                    self._running_ids.add(task_id)
 
                     logger.info(f"Started execution of task: {task_id}")
 
@@ -342,46 +457,240 @@ class ContentScheduler:
 
     async def _execute_task(self, task_id: str) -> None:
         """Execute a specific task"""
+        # Wait for a free slot before starting, queued tasks keep reporting PENDING
+        async with self._exec_sem:
+            try:
+                # State transitions share the lock with cancellation so neither overwrites the other
+                async with self._lock:
+                    task = self.tasks[task_id]
+                    if task.status is not PENDING:
+                        return
+                    task.status = RUNNING
+                    task.started_at = datetime.now()
+                await self._persist_task(task)
+
+                # Get the appropriate callback for this task type
+                callback = self.task_callbacks.get(task.task_type)
+
+                if not callback:
+                    raise Exception(f"No callback registered for task type: {task.task_type}")
+
+                # Execute the task, fanning out payload items when the callback handles one item at a time
+                items = task.payload.get("items")
+                if isinstance(items, list) and getattr(callback, "supports_batch", False):
+                    result = await self._execute_batch(task, callback, items)
+                else:
+                    result = await callback(task.payload)
+
+                if result.get("success", False):
+                    async with self._lock:
+                        if task.status is not RUNNING:
+                            return
+                        task.status = COMPLETED
+                        task.completed_at = datetime.now()
+                    await self._persist_task(task)
+                    logger.info(f"Task completed successfully: {task_id}")
+                else:
+                    raise Exception(result.get("error", "Task execution failed"))
+
+            except Exception as e:
+                async with self._lock:
+                    task = self.tasks.get(task_id)
+                    if task is None or task.status is not RUNNING:
+                        return
+                    task.retry_count += 1
+                    task.error_message = str(e)
+                    will_retry = task.retry_count < task.max_retries
+
+                    if will_retry:
+                        # Schedule retry; release the running slot in the same step so the loop
+                        # does not discard the new heap entry as belonging to a running task
+                        self._release_running(task_id)
+                        task.status = PENDING
+                        task.scheduled_time = datetime.now() + timedelta(minutes=self.retry_delay)
+                        self._push_pending(task)
+                        self._wakeup.set()
+                    else:
+                        task.status = FAILED
+                        task.completed_at = datetime.now()
+
+                await self._persist_task(task)
+                if will_retry:
+                    logger.warning(f"Task {task_id} failed, scheduling retry {task.retry_count}/{task.max_retries}")
+                else:
+                    logger.error(f"Task {task_id} failed permanently after {task.retry_count} retries: {str(e)}")
+
+            finally:
+                # Clean up running task reference
+                async with self._lock:
+                    self._release_running(task_id)
+
+    def _release_running(self, task_id: str) -> None:
+        """Forget the running reference for task_id if it belongs to the current asyncio task; caller holds _lock"""
+        # A retry may already have been started under the same id, leave its reference alone
+        if self.running_tasks.get(task_id) is asyncio.current_task():
+            del self.running_tasks[task_id]
+            self._running_ids.discard(task_id)
+
+    async def _execute_batch(self, task: ScheduledTask, callback: Callable, items: List[Any]) -> Dict[str, Any]:
+        """Run the callback once per payload item concurrently and combine the results"""
+        async def run_item(item: Any) -> Dict[str, Any]:
+            async with self._item_sem:
+                return await callback({**task.payload, "item": item})
+
+        results = await asyncio.gather(*(run_item(item) for item in items), return_exceptions=True)
+
+        errors = []
+        failed_items = []
+        for item, result in zip(items, results):
+            if isinstance(result, BaseException):
+                errors.append(str(result))
+            elif not result.get("success", False):
+                errors.append(result.get("error", "Task execution failed"))
+            else:
+                continue
+            failed_items.append(item)
+
+        if not failed_items:
+            return {"success": True, "results": results}
+
+        # A retry only needs to redo the failed items, the others already went out
+        task.payload = {**task.payload, "items": failed_items}
+        return {
+            "success": False,
+            "error": f"{len(failed_items)}/{len(items)} batch items failed: {errors[0]}"
+        }
+
+    async def _wait_for_next_task(self) -> None:
+        """Sleep until the next pending task is due or the schedule changes"""
         try:
-            task = self.tasks[task_id]
-            task.status = TaskStatus.RUNNING
-            task.started_at = datetime.now()
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self._seconds_until_next_task())
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    def _seconds_until_next_task(self) -> Optional[float]:
+        """Seconds until the next pending task is due, None if nothing is pending"""
+        if not self._pending_heap:
+            return None
+        return max(0, self._pending_heap[0][0] - asyncio.get_running_loop().time())
+
+    def _push_pending(self, task: ScheduledTask) -> None:
+        """Queue a pending task on the heap, keyed by its due time on the event loop clock"""
+        delay = (task.scheduled_time - datetime.now()).total_seconds()
+        task.scheduled_time_monotonic = asyncio.get_running_loop().time() + delay
+        heapq.heappush(self._pending_heap, (task.scheduled_time_monotonic, task.task_id))
+
+    async def _open_store(self) -> None:
+        """Open the task database and load tasks that survived the last run"""
+        try:
+            if self._db is None:
+                self._db = await aiosqlite.connect(SCHEDULER_DB_PATH)
+                await self._db.execute(CREATE_TASKS_TABLE)
+                await self._db.execute(CREATE_TASKS_INDEX)
+                await self._db.commit()
+
+            async with self._db.execute("SELECT * FROM tasks") as cursor:
+                rows = await cursor.fetchall()
+
+            for row in rows:
+                task = self._task_from_row(row)
+                if task.task_id in self.tasks:
+                    continue
 
-            # Get the appropriate callback for this task type
-            callback = self.task_callbacks.get(task.task_type)
+                # A task that was running when the process stopped gets another attempt
+                if task.status == TaskStatus.RUNNING:
+                    task.status = TaskStatus.PENDING
+                    task.started_at = None
 
-            if not callback:
-                raise Exception(f"No callback registered for task type: {task.task_type}")
+                self.tasks[task.task_id] = task
+                if task.status == TaskStatus.PENDING:
+                    self._push_pending(task)
 
-            # Execute the task
-            result = await callback(task.payload)
+            logger.info(f"Loaded {len(rows)} tasks from {SCHEDULER_DB_PATH}")
 
-            if result.get("success", False):
-                task.status = TaskStatus.COMPLETED
-                task.completed_at = datetime.now()
-                logger.info(f"Task completed successfully: {task_id}")
-            else:
-                raise Exception(result.get("error", "Task execution failed"))
+        except Exception as e:
+            # Keep scheduling in memory rather than refusing to start
+            logger.error(f"Failed to open task store {SCHEDULER_DB_PATH}: {str(e)}")
+            self._db = None
+
+    async def _persist_task(self, task: ScheduledTask) -> None:
+        """Write the current state of a task to the database"""
+        if self._db is None:
+            return
+
+        try:
+            await self._db.execute(UPSERT_TASK, (
+                task.task_id,
+                task.task_type,
+                json.dumps(task.payload),
+                task.scheduled_time.timestamp(),
+                task.status.value,
+                task.created_at.timestamp(),
+                task.started_at.timestamp() if task.started_at else None,
+                task.completed_at.timestamp() if task.completed_at else None,
+                task.error_message,
+                task.retry_count,
+                task.max_retries
+            ))
+            await self._db.commit()
 
         except Exception as e:
-            task = self.tasks[task_id]
-            task.retry_count += 1
-            task.error_message = str(e)
-
-            if task.retry_count < task.max_retries:
-                # Schedule retry
-                task.status = TaskStatus.PENDING
-                task.scheduled_time = datetime.now() + timedelta(minutes=self.retry_delay)
-                logger.warning(f"Task {task_id} failed, scheduling retry {task.retry_count}/{task.max_retries}")
-            else:
-                task.status = TaskStatus.FAILED
-                task.completed_at = datetime.now()
-                logger.error(f"Task {task_id} failed permanently after {task.retry_count} retries: {str(e)}")
+            logger.error(f"Failed to persist task {task.task_id}: {str(e)}")
+
+    @staticmethod
+    def _task_from_row(row: Tuple) -> ScheduledTask:
+        """Build a ScheduledTask from a tasks table row"""
+        (task_id, task_type, payload, scheduled_time, status, created_at,
+         started_at, completed_at, error_message, retry_count, max_retries) = row
+        return ScheduledTask(
+            task_id=task_id,
+            task_type=task_type,
+            scheduled_time=datetime.fromtimestamp(scheduled_time),
+            payload=json.loads(payload),
+            status=TaskStatus(status),
+            created_at=datetime.fromtimestamp(created_at),
+            started_at=datetime.fromtimestamp(started_at) if started_at is not None else None,
+            completed_at=datetime.fromtimestamp(completed_at) if completed_at is not None else None,
+            error_message=error_message,
+            retry_count=retry_count,
+            max_retries=max_retries
+        )
+
+    async def _purge_loop(self) -> None:
+        """Periodically evict finished tasks older than the retention window"""
+        try:
+            while self.scheduler_running:
+                await self._purge_finished_tasks()
+                await asyncio.sleep(PURGE_INTERVAL_SECONDS)
+        except asyncio.CancelledError:
+            pass
+
+    async def _purge_finished_tasks(self) -> None:
+        """Drop finished tasks past retention from memory and the database"""
+        try:
+            cutoff = datetime.now() - timedelta(days=SCHEDULER_RETENTION_DAYS)
+
+            async with self._lock:
+                expired = [
+                    task_id for task_id, task in self.tasks.items()
+                    if task.status.value in FINISHED_STATUSES and task.completed_at and task.completed_at < cutoff
+                ]
+                for task_id in expired:
+                    del self.tasks[task_id]
+
+            if self._db is not None:
+                await self._db.execute(
+                    f"DELETE FROM tasks WHERE status IN ({', '.join('?' * len(FINISHED_STATUSES))}) AND completed_at < ?",
+                    (*FINISHED_STATUSES, cutoff.timestamp())
+                )
+                await self._db.commit()
+
+            if expired:
+                logger.info(f"Evicted {len(expired)} finished tasks older than {SCHEDULER_RETENTION_DAYS} days")
 
-        finally:
-            # Clean up running task reference
-            if task_id in self.running_tasks:
-                del self.running_tasks[task_id]
+        except Exception as e:
+            logger.error(f"Failed to purge finished tasks: {str(e)}")
 
     def _get_current_pipeline_stage(self, task_id: str) -> str:
         """Get current pipeline stage for a task"""